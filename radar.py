@@ -1,7 +1,18 @@
-from fastapi import FastAPI
-from fastapi.responses import PlainTextResponse
-import requests
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse, Response
+from redis.asyncio.retry import Retry
+from redis.backoff import NoBackoff
+from redis.exceptions import RedisError
+import redis.asyncio as redis
+import httpx
+import asyncio
+import functools
+import hashlib
+import operator
+import orjson
+import os
 import re
+import time
 
 app = FastAPI(
     title="Radar do Caçador",
@@ -10,12 +21,32 @@ app = FastAPI(
 )
 
 URLS_FILE = "urls.txt"
-ML_ITEM_URL = "https://api.mercadolibre.com/items/{item_id}"
+ML_ITENS_URL = "https://api.mercadolibre.com/items?ids={ids}&attributes={atributos}"
+ML_LOTE_MAX = 20  # limite de ids por chamada do multi-get
+# Só os campos que o Produto realmente usa: resposta bem menor
+ML_ATRIBUTOS = "id,title,price,original_price,deal_ids,permalink"
+CAMPOS_ITEM = operator.itemgetter("title", "price", "original_price", "deal_ids", "permalink")
+MLB_RE = re.compile(r"MLB\d+")
+# Id do anúncio nos parâmetros do link de afiliado (pdp_filters / wid)
+ANUNCIO_RE = re.compile(r"(?:item_id%3A|item_id:|[?&#]wid=)(MLB\d+)")
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Timeouts curtos e sem retry: com o Redis fora, o pacote não pode travar
+REDIS_TIMEOUT = 0.1
+CACHE_TTL_ITEM = 30             # preço muda rápido: cache curto
+CACHE_TTL_ITEM_STALE = 24 * 3600  # cópia de reserva caso a API falhe
+CACHE_TTL_PACOTE = 60           # texto pronto de cada turno, em memória
+CACHE_CONTROL_PACOTE = "public, max-age={max_age}, stale-while-revalidate=120"
 
 FATIAS_TURNO = {
-    "manha": (0, 3),
-    "tarde": (3, 6),
-    "noite": (6, 9)
+    "manha": slice(0, 3),
+    "tarde": slice(3, 6),
+    "noite": slice(6, 9)
+}
+
+# Cabeçalho de cada pacote, montado uma vez só
+CABECALHO_TURNO = {
+    turno: f"⚡ Pacote — {turno} — Caçador de Ofertas\n" for turno in FATIAS_TURNO
 }
 
 # ============================
@@ -23,6 +54,8 @@ FATIAS_TURNO = {
 # ============================
 
 class Produto:
+    __slots__ = ("nome", "preco", "preco_original", "cupom", "url")
+
     def __init__(self, nome, preco, preco_original, cupom, url):
         self.nome = nome
         self.preco = preco
@@ -36,63 +69,161 @@ class Produto:
 # ============================
 
 def formatar_preco(valor):
-    s = f"{valor:,.2f}"
-    s = s.replace(",", "X").replace(".", ",").replace("X", ".")
-    return f"R$ {s}"
+    # Agrupa os milhares numa passada só, sem a cadeia de replace()
+    sinal = "-" if valor < 0 else ""
+    inteiro, frac = f"{abs(valor):.2f}".split(".")
 
+    grupos = []
+    i = len(inteiro)
+    while i > 3:
+        grupos.append(inteiro[i - 3:i])
+        i -= 3
+    grupos.append(inteiro[:i])
 
-def formatar_post(produto, indice):
-    texto = f"🟡 Oferta {indice}\n\n"
-    texto += f"{produto.nome}\n\n"
+    return f"R$ {sinal}{'.'.join(reversed(grupos))},{frac}"
 
+
+def formatar_post(produto, indice):
     # Preço original caso exista
     if produto.preco_original and produto.preco_original > produto.preco:
-        texto += f"💸 De {formatar_preco(produto.preco_original)} → Por {formatar_preco(produto.preco)}\n\n"
+        preco = f"💸 De {formatar_preco(produto.preco_original)} → Por {formatar_preco(produto.preco)}"
     else:
-        texto += f"💸 Por {formatar_preco(produto.preco)}\n\n"
+        preco = f"💸 Por {formatar_preco(produto.preco)}"
 
     # Cupom — se existir
-    if produto.cupom:
-        texto += f"🎟️ Cupom: {produto.cupom}\n\n"
+    cupom = f"🎟️ Cupom: {produto.cupom}\n\n" if produto.cupom else ""
+
+    return (
+        f"🟡 Oferta {indice}\n\n"
+        f"{produto.nome}\n\n"
+        f"{preco}\n\n"
+        f"{cupom}"
+        "🔗 Link:\n"
+        f"{produto.url}\n\n"
+        "⚠️ Preço pode mudar a qualquer momento."
+    )
+
 
-    # Link
-    texto += "🔗 Link:\n"
-    texto += f"{produto.url}\n\n"
+# ============================
+# CACHE (REDIS)
+# ============================
+
+# O cache é um atalho, não uma dependência: se o Redis estiver fora do ar
+# tudo segue funcionando, só que indo direto na API.
+
+async def ler_cache_varios(chaves):
+    if cache_redis is None or not chaves:
+        return [None] * len(chaves)
+    try:
+        return await cache_redis.mget(chaves)
+    except RedisError:
+        return [None] * len(chaves)
 
-    texto += "⚠️ Preço pode mudar a qualquer momento."
 
-    return texto
+async def gravar_cache_varios(entradas):
+    # entradas: [(chave, ttl, valor)], enviadas numa única ida ao Redis
+    if cache_redis is None or not entradas:
+        return
+    try:
+        pipe = cache_redis.pipeline(transaction=False)
+        for chave, ttl, valor in entradas:
+            pipe.setex(chave, ttl, valor)
+        await pipe.execute()
+    except RedisError:
+        pass
 
 
 # ============================
 # FUNÇÃO PARA BUSCAR PRODUTO
 # ============================
 
+@functools.lru_cache(maxsize=2048)
 def obter_item_id(url):
-    ids = re.findall(r"(MLB\\d+)", url)
-    if not ids:
-        return None
-    return max(ids, key=len)
+    # As mesmas URLs de urls.txt se repetem a cada pacote.
+    # /items só aceita id de anúncio, nunca o de catálogo (/p/MLB...):
+    # primeiro o id declarado no link, senão o último MLB da URL.
+    anuncio = ANUNCIO_RE.search(url)
+    if anuncio:
+        return anuncio.group(1)
 
+    ultimo = None
+    for m in MLB_RE.finditer(url):
+        ultimo = m.group(0)
+    return ultimo
 
-def buscar_produto(url):
-    item_id = obter_item_id(url)
-    if not item_id:
-        return None
 
-    api_url = ML_ITEM_URL.format(item_id=item_id)
-    r = requests.get(api_url)
+def chave_item(item_id):
+    return f"meli:item:{item_id}"
 
-    if r.status_code != 200:
-        return None
 
-    data = r.json()
-
-    nome = data.get("title", "Produto sem nome")
-    preco = data.get("price", 0.0)
-    preco_original = data.get("original_price", preco)
-    cupom = data.get("deal_ids", None)  # alguns itens carregam cupons aqui
-    link = data.get("permalink", url)
+async def buscar_lote_api(cliente, item_ids):
+    # Uma única chamada ao multi-get para até ML_LOTE_MAX itens.
+    # Devolve {item_id: corpo} apenas dos itens que vieram com código 200.
+    api_url = ML_ITENS_URL.format(ids=",".join(item_ids), atributos=ML_ATRIBUTOS)
+    try:
+        r = await cliente.get(api_url)
+        if r.status_code != 200:
+            return {}
+        respostas = orjson.loads(r.content)
+    except (httpx.HTTPError, ValueError):
+        return {}
+
+    # Qualquer formato inesperado vira "item não encontrado", nunca um 500
+    if not isinstance(respostas, list):
+        return {}
+
+    corpos = {}
+    for resposta in respostas:
+        if not isinstance(resposta, dict) or resposta.get("code") != 200:
+            continue
+        corpo = resposta.get("body")
+        if isinstance(corpo, dict) and corpo.get("id"):
+            corpos[corpo["id"]] = corpo
+    return corpos
+
+
+async def buscar_itens(cliente, item_ids):
+    item_ids = list(dict.fromkeys(i for i in item_ids if i))
+    itens = {}
+
+    faltando = []
+    em_cache = await ler_cache_varios([chave_item(i) for i in item_ids])
+    for item_id, bruto in zip(item_ids, em_cache):
+        if bruto is not None:
+            itens[item_id] = orjson.loads(bruto)
+        else:
+            faltando.append(item_id)
+
+    lotes = [faltando[i:i + ML_LOTE_MAX] for i in range(0, len(faltando), ML_LOTE_MAX)]
+    novos = []
+    for corpos in await asyncio.gather(*(buscar_lote_api(cliente, lote) for lote in lotes)):
+        for item_id, corpo in corpos.items():
+            itens[item_id] = corpo
+            bruto = orjson.dumps(corpo)
+            novos.append((chave_item(item_id), CACHE_TTL_ITEM, bruto))
+            novos.append((f"{chave_item(item_id)}:stale", CACHE_TTL_ITEM_STALE, bruto))
+    await gravar_cache_varios(novos)
+
+    # API fora do ar: melhor um preço de alguns minutos atrás do que nada
+    sem_resposta = [i for i in faltando if i not in itens]
+    reservas = await ler_cache_varios([f"{chave_item(i)}:stale" for i in sem_resposta])
+    for item_id, bruto in zip(sem_resposta, reservas):
+        if bruto is not None:
+            itens[item_id] = orjson.loads(bruto)
+
+    return itens
+
+
+def montar_produto(data, url):
+    try:
+        # Caminho comum: o multi-get com attributes= traz todos os campos
+        nome, preco, preco_original, cupom, link = CAMPOS_ITEM(data)
+    except KeyError:
+        nome = data.get("title", "Produto sem nome")
+        preco = data.get("price", 0.0)
+        preco_original = data.get("original_price", preco)
+        cupom = data.get("deal_ids", None)  # alguns itens carregam cupons aqui
+        link = data.get("permalink", url)
 
     return Produto(nome, preco, preco_original, cupom, link)
 
@@ -101,62 +232,143 @@ def buscar_produto(url):
 # LEITURA DE URLs
 # ============================
 
+# (mtime, urls) da última leitura: o arquivo só é relido quando muda
+cache_urls = None
+
+
 def carregar_urls():
+    global cache_urls
     try:
-        with open(URLS_FILE, "r") as f:
-            urls = [linha.strip() for linha in f.readlines() if linha.strip()]
+        mtime = os.stat(URLS_FILE).st_mtime_ns
+        if cache_urls is not None and cache_urls[0] == mtime:
+            return cache_urls[1]
+
+        with open(URLS_FILE, "r", encoding="utf-8") as f:
+            urls = [linha for linha in (bruta.strip() for bruta in f) if linha]
+        cache_urls = (mtime, urls)
         return urls
     except:
         return []
 
 
+# ============================
+# CONEXÕES
+# ============================
+
+# Um único cliente compartilhado entre as requisições mantém as conexões
+# com a API do Mercado Livre abertas (keep-alive, HTTP/2) em vez de refazer
+# o handshake TCP/TLS a cada produto. O cliente Redis segue a mesma ideia.
+cliente_http = None
+cache_redis = None
+
+
+@app.on_event("startup")
+async def abrir_conexoes():
+    global cliente_http, cache_redis
+    cache_redis = redis.from_url(
+        REDIS_URL,
+        socket_connect_timeout=REDIS_TIMEOUT,
+        socket_timeout=REDIS_TIMEOUT,
+        retry=Retry(NoBackoff(), 0),
+    )
+    cliente_http = httpx.AsyncClient(
+        http2=True,
+        timeout=10.0,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+    )
+
+
+@app.on_event("shutdown")
+async def fechar_conexoes():
+    if cliente_http is not None:
+        await cliente_http.aclose()
+    if cache_redis is not None:
+        await cache_redis.aclose()
+
+
 # ============================
 # ROTAS
 # ============================
 
 @app.get("/", response_class=PlainTextResponse)
-def raiz():
+async def raiz():
     return "Radar do Caçador online! ⚡"
 
 
 @app.get("/teste", response_class=PlainTextResponse)
-def teste():
+async def teste():
     return "Rota de teste OK!"
 
 
+# turno -> (momento da montagem, texto do pacote, etag)
+cache_pacotes = {}
+
+
+def responder_pacote(request, texto, etag, max_age):
+    # Deixa navegador/proxy reaproveitarem o pacote sem chegar até aqui.
+    # max_age é o que ainda resta do TTL, para não somar validades.
+    cabecalhos = {
+        "Cache-Control": CACHE_CONTROL_PACOTE.format(max_age=max_age),
+        "ETag": etag,
+    }
+    # If-None-Match usa comparação fraca: proxies que comprimem a resposta
+    # (nginx com gzip, por exemplo) devolvem a etag como W/"..."
+    enviados = request.headers.get("if-none-match", "")
+    tags = {t.strip().removeprefix("W/") for t in enviados.split(",")}
+    if "*" in tags or etag.removeprefix("W/") in tags:
+        return Response(status_code=304, headers=cabecalhos)
+    return PlainTextResponse(texto, headers=cabecalhos)
+
+
 @app.get("/pacote/{turno}", response_class=PlainTextResponse)
-def gerar_pacote(turno: str):
+async def gerar_pacote(turno: str, request: Request):
 
     turno = turno.lower()
     if turno not in FATIAS_TURNO:
         return "❌ Turno inválido. Use: manha, tarde, noite."
 
+    agora = time.monotonic()
+    em_cache = cache_pacotes.get(turno)
+    if em_cache and agora - em_cache[0] < CACHE_TTL_PACOTE:
+        restante = max(CACHE_TTL_PACOTE - int(agora - em_cache[0]), 0)
+        return responder_pacote(request, em_cache[1], em_cache[2], restante)
+
     urls = carregar_urls()
     if not urls:
         return (
-            f"⚡ Pacote — {turno} — Caçador de Ofertas\n\n"
+            f"{CABECALHO_TURNO[turno]}\n"
             "Não há produtos cadastrados em urls.txt no momento.\n"
             "Adicione algumas URLs e tente novamente."
         )
 
-    inicio, fim = FATIAS_TURNO[turno]
-    urls_turno = urls[inicio:fim]
+    urls_turno = urls[FATIAS_TURNO[turno]]
 
-    linhas = [f"⚡ Pacote — {turno} — Caçador de Ofertas\n"]
+    linhas = [CABECALHO_TURNO[turno]]
 
     if not urls_turno:
         linhas.append("Nenhum produto disponível para este turno.")
         return "\n".join(linhas)
 
-    for i, url in enumerate(urls_turno, start=1):
-        produto = buscar_produto(url)
+    # Todos os produtos do turno em uma única ida à API
+    ids = [obter_item_id(url) for url in urls_turno]
+    itens = await buscar_itens(cliente_http, ids)
 
-        if not produto:
+    completo = True
+    for i, (url, item_id) in enumerate(zip(urls_turno, ids), start=1):
+        data = itens.get(item_id)
+        if data is None:
             linhas.append(f"❌ Erro ao buscar dados do produto {i}")
+            completo = False
             continue
 
-        post = formatar_post(produto, i)
-        linhas.append(post)
-        linhas.append("")
+        produto = montar_produto(data, url)
+        linhas.append(f"{formatar_post(produto, i)}\n")
+
+    texto = "\n".join(linhas)
+    # Pacote com erro não vai para o cache: a próxima chamada tenta de novo
+    if not completo:
+        return texto
 
-    return "\n".join(linhas)
+    etag = f'"{hashlib.blake2b(texto.encode(), digest_size=8).hexdigest()}"'
+    cache_pacotes[turno] = (agora, texto, etag)
+    return responder_pacote(request, texto, etag, CACHE_TTL_PACOTE)